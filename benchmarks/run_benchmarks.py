@@ -0,0 +1,211 @@
+"""Offline benchmarks for the storage, search, analytics and export hot paths.
+
+Usage:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --message-chars 2000
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Each operation is timed over several repeats (median and min reported) and run
+once more under tracemalloc for peak memory. Data is synthetic and written to a
+temporary directory, so nothing touches data/ or the network.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from utils import storage
+from pages.analytics import build_timeline_frame, build_recent_table, compute_usage_insights, split_recent_weeks
+
+CONVERSATION_TYPES = ["general", "creative", "technical", "educational", "casual"]
+WORDS = (
+    "model prompt python image story code review explain research problem step "
+    "data chart learning creative answer question context token latency cache"
+).split()
+
+def make_text(rng, chars):
+    """Random ASCII text of roughly the requested length"""
+    parts = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)[:chars]
+
+def generate_conversation(rng, conv_id, messages_per_conversation, message_chars, now):
+    """One synthetic conversation in the storage format"""
+    messages = []
+    for i in range(messages_per_conversation):
+        message = {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": make_text(rng, message_chars)
+        }
+        if message["role"] == "assistant":
+            message["usage"] = {"in": rng.randint(50, 2000), "out": message_chars // 4, "ms": rng.randint(200, 3000)}
+        messages.append(message)
+
+    created_at = now - timedelta(days=rng.randint(0, 90), seconds=rng.randint(0, 86399))
+    return {
+        "id": conv_id,
+        "title": make_text(rng, 40),
+        "messages": messages,
+        "type": rng.choice(CONVERSATION_TYPES),
+        "created_at": created_at.isoformat(),
+        "message_count": len(messages),
+        "tokens": storage.sum_message_tokens(messages)
+    }
+
+def generate_conversations(count, messages_per_conversation=6, message_chars=200, seed=0):
+    """Deterministic list of synthetic conversations"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    return [
+        generate_conversation(rng, i + 1, messages_per_conversation, message_chars, now)
+        for i in range(count)
+    ]
+
+def write_dataset(conversations):
+    """Persist conversations in the on-disk snapshot format"""
+    storage._write_snapshot(storage.CONVERSATIONS_FILE, conversations)
+    open(storage.JOURNAL_FILE, 'w').close()
+    storage.clear_cache()
+
+def analytics_prep():
+    """Data preparation done by render_analytics, without the Streamlit calls"""
+    stats = storage.get_conversation_stats()
+    conversations = storage.get_conversations()
+    build_timeline_frame(conversations)
+    build_recent_table(conversations)
+    compute_usage_insights(conversations, stats)
+    split_recent_weeks(conversations)
+
+def measure(func, repeat):
+    """Median/min wall time over `repeat` runs plus peak traced memory of one run"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_s": round(statistics.median(timings), 6),
+        "min_s": round(min(timings), 6),
+        "peak_mb": round(peak / (1024 * 1024), 3)
+    }
+
+def benchmark_size(size, args):
+    """Run every operation against a dataset of `size` conversations"""
+    conversations = generate_conversations(size, args.messages_per_conversation, args.message_chars, args.seed)
+    write_dataset(conversations)
+
+    # Exports work on a single conversation; use one sized like a long chat
+    export_conv = generate_conversation(
+        random.Random(args.seed), 0, args.export_messages, args.message_chars, datetime.now()
+    )
+    del conversations
+
+    operations = {
+        "get_conversations_cold": lambda: (storage.clear_cache(), storage.get_conversations()),
+        "get_conversations": storage.get_conversations,
+        "search_conversations_miss": lambda: storage.search_conversations("no-such-term"),
+        "search_conversations_hit": lambda: storage.search_conversations("latency"),
+        "get_conversation_stats": storage.get_conversation_stats,
+        "analytics_prep": analytics_prep,
+        "export_conversation_markdown": lambda: storage.export_conversation_markdown(export_conv),
+        "export_conversation_pdf": lambda: storage.export_conversation_pdf(export_conv),
+    }
+
+    results = {}
+    for name, func in operations.items():
+        results[name] = measure(func, args.repeat)
+        print(f"  {name:<30} median {results[name]['median_s'] * 1000:>10.2f} ms"
+              f"   peak {results[name]['peak_mb']:>9.2f} MB")
+    return results
+
+def compare(results, baseline, threshold):
+    """Print per-operation change against a baseline; return True on regression"""
+    regressed = False
+    print(f"\nComparison against baseline (threshold {threshold:.0%}):")
+    for size, ops in results.items():
+        for name, current in ops.items():
+            previous = baseline.get(size, {}).get(name)
+            if not previous or not previous["median_s"]:
+                continue
+            change = current["median_s"] / previous["median_s"] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressed = True
+            print(f"  {size:>7} {name:<30} {change:>+8.1%}{flag}")
+    return regressed
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AIConverse storage, search, analytics and export")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of conversations to generate")
+    parser.add_argument("--messages-per-conversation", type=int, default=6)
+    parser.add_argument("--message-chars", type=int, default=200, help="characters per message")
+    parser.add_argument("--export-messages", type=int, default=50, help="messages in the exported conversation")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage.DATA_DIR = tmp_dir
+        storage.CONVERSATIONS_FILE = os.path.join(tmp_dir, "conversations.json")
+        storage.JOURNAL_FILE = os.path.join(tmp_dir, "conversations.journal.jsonl")
+        storage.BLOB_DIR = os.path.join(tmp_dir, "blobs")
+        storage.PARTITIONS_DIR = os.path.join(tmp_dir, "users")
+        storage.init_storage()
+
+        for size in args.sizes:
+            print(f"\n{size} conversations x {args.messages_per_conversation} messages x {args.message_chars} chars")
+            results[str(size)] = benchmark_size(size, args)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({
+                "generated_at": datetime.now().isoformat(),
+                "config": {
+                    "messages_per_conversation": args.messages_per_conversation,
+                    "message_chars": args.message_chars,
+                    "export_messages": args.export_messages,
+                    "repeat": args.repeat,
+                    "seed": args.seed
+                },
+                "results": results
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline["results"], args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
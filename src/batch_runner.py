@@ -0,0 +1,165 @@
+"""Batch prompt runner for offline evaluation and throughput testing.
+
+Usage:
+    python src/batch_runner.py prompts.jsonl -o results.jsonl --workers 8
+    python src/batch_runner.py prompts.jsonl --fake --fake-latency 0.2 --save
+
+Each input line is a JSON object with a "prompt" and optional "type",
+"temperature", "context" and "id" fields.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from utils.gemini_client import GeminiClient
+from utils.fake_backend import FakeBackend
+from utils.metrics import init_metrics, percentile
+from utils.storage import init_storage, save_conversation, partition_key, DEFAULT_PARTITION
+
+def load_prompts(path):
+    """Read prompt records from a JSONL file"""
+    prompts = []
+    with open(path, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "prompt" not in record:
+                raise ValueError(f"{path}:{line_no}: missing 'prompt' field")
+            record.setdefault("id", line_no)
+            record.setdefault("type", "general")
+            record.setdefault("temperature", 0.7)
+            record.setdefault("context", "")
+            prompts.append(record)
+    return prompts
+
+def run_prompt(client, record, submitted_at):
+    """Run one prompt and return a result record"""
+    start = time.perf_counter()
+    queue_wait_ms = (start - submitted_at) * 1000
+    # Take failures from the client rather than guessing from the reply text
+    error = None
+    try:
+        response, usage = client.get_smart_response(
+            record["prompt"],
+            record["context"],
+            record["type"],
+            temperature=record["temperature"],
+            with_usage=True,
+            raise_errors=True
+        )
+    except Exception as e:
+        response, usage, error = f"Error: {str(e)}", None, type(e).__name__
+    latency_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "id": record["id"],
+        "type": record["type"],
+        "temperature": record["temperature"],
+        "prompt": record["prompt"],
+        "response": response,
+        "queue_wait_ms": round(queue_wait_ms, 2),
+        "latency_ms": round(latency_ms, 2),
+        "usage": usage,
+        "error": error
+    }
+
+def run_batch(client, prompts, workers=4, output=None, save=False, partition=DEFAULT_PARTITION):
+    """Run prompts with bounded parallelism and return (results, wall time)"""
+    results = []
+    out_file = open(output, 'w') if output else None
+    start = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_prompt, client, record, time.perf_counter()) for record in prompts]
+
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+
+                if out_file:
+                    out_file.write(json.dumps(result) + "\n")
+
+                if save and not result["error"]:
+                    messages = [
+                        {"role": "user", "content": result["prompt"]},
+                        {"role": "assistant", "content": result["response"], "usage": result["usage"]}
+                    ]
+                    save_conversation(f"Batch - {result['id']}", messages, result["type"], partition)
+    finally:
+        if out_file:
+            out_file.close()
+
+    return results, time.perf_counter() - start
+
+def summarize(results, elapsed):
+    """Latency percentiles and throughput for a finished batch"""
+    latencies = [r["latency_ms"] for r in results]
+    queue_waits = [r["queue_wait_ms"] for r in results]
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p95_queue_wait_ms": round(percentile(queue_waits, 95), 2),
+        "input_tokens": sum(r["usage"]["in"] for r in results if r["usage"]),
+        "output_tokens": sum(r["usage"]["out"] for r in results if r["usage"]),
+        "wall_time_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+def build_client(args):
+    """Create a GeminiClient backed by the real API or the fake backend"""
+    if args.fake:
+        backend = FakeBackend(
+            latency=args.fake_latency,
+            jitter=args.fake_jitter,
+            error_rate=args.fake_error_rate,
+            seed=args.seed
+        )
+        return GeminiClient(None, backend=backend, cache_size=args.cache_size)
+
+    api_key = os.getenv('GOOGLE_API_KEY')
+    if not api_key or api_key == 'your_gemini_api_key_here':
+        sys.exit("GOOGLE_API_KEY is not set; use --fake to run without network access")
+    return GeminiClient(api_key, cache_size=args.cache_size)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through GeminiClient")
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("-o", "--output", help="write results as JSONL to this file")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="maximum concurrent requests")
+    parser.add_argument("--save", action="store_true", help="store each result as a conversation")
+    parser.add_argument("--user", help="save into this user's storage partition (default: shared)")
+    parser.add_argument("--cache-size", type=int, default=0, help="response cache entries (0 disables)")
+    parser.add_argument("--fake", action="store_true", help="use the offline fake backend")
+    parser.add_argument("--fake-latency", type=float, default=0.05, help="fake backend latency in seconds")
+    parser.add_argument("--fake-jitter", type=float, default=0.02, help="fake backend latency jitter in seconds")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0, help="fraction of fake requests that fail")
+    parser.add_argument("--seed", type=int, help="random seed for the fake backend")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    init_metrics()
+
+    prompts = load_prompts(args.input)
+    client = build_client(args)
+
+    partition = partition_key(args.user)
+    if args.save:
+        init_storage(partition)
+
+    results, elapsed = run_batch(client, prompts, args.workers, args.output, args.save, partition)
+    summary = summarize(results, elapsed)
+
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
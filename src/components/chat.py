@@ -1,18 +1,97 @@
+import io
 import streamlit as st
-from PIL import Image
-from utils.storage import save_conversation, export_conversation_pdf, export_conversation_markdown
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from utils.storage import (
+    save_conversation, append_messages, rename_conversation, get_conversation,
+    save_image_blob, get_blob_path,
+    export_conversation_pdf, export_conversation_markdown
+)
 from datetime import datetime
 
+# Longest side sent to the model; larger uploads are downscaled before the request
+MAX_IMAGE_SIDE = 1536
+
+def assistant_message(content, usage=None):
+    """Build an assistant message, keeping token usage when the model reported it"""
+    message = {"role": "assistant", "content": content}
+    if usage:
+        message["usage"] = usage
+    return message
+
+def start_conversation(conversation):
+    """Make a stored conversation the active, autosaved chat"""
+    st.session_state.messages = list(conversation['messages'])
+    st.session_state.conversation_id = conversation['id']
+    st.session_state.conversation_title = conversation['title']
+    st.session_state.persisted_count = len(conversation['messages'])
+    st.query_params["conversation"] = str(conversation['id'])
+
+def reset_conversation():
+    """Forget the active conversation so the next turn starts a new one"""
+    for key in ['messages', 'conversation_id', 'conversation_title', 'persisted_count']:
+        if key in st.session_state:
+            del st.session_state[key]
+    if "conversation" in st.query_params:
+        del st.query_params["conversation"]
+
+def autosave_conversation():
+    """Persist messages added since the last save, creating the conversation on the first turn"""
+    messages = st.session_state.messages
+    conv_id = st.session_state.get('conversation_id')
+    
+    if conv_id is not None:
+        try:
+            append_messages(conv_id, messages[st.session_state.get('persisted_count', 0):], st.session_state.partition)
+        except KeyError:
+            # Deleted from another tab or session; keep the whole chat in a new conversation
+            conv_id = None
+    
+    if conv_id is None:
+        first_user_message = next((m["content"] for m in messages if m["role"] == "user"), "")
+        title = first_user_message[:40] or f"Chat - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        conv_type = st.session_state.get('conversation_type', 'general')
+        conv_id = save_conversation(title, messages, conv_type, st.session_state.partition)
+        
+        st.session_state.conversation_id = conv_id
+        st.session_state.conversation_title = title
+        st.query_params["conversation"] = str(conv_id)
+    
+    st.session_state.persisted_count = len(messages)
+
+def prepare_image(uploaded_file, partition):
+    """Store an upload in the partition's blob store and decode it for the model"""
+    data = uploaded_file.getvalue()
+    blob_id = save_image_blob(data, uploaded_file.name, partition)
+    
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return blob_id, image
+
+def prepare_images(uploaded_files):
+    """Decode, downscale and store uploads in parallel, preserving upload order"""
+    # Worker threads have no Streamlit session, so look the partition up here
+    partition = st.session_state.partition
+    with ThreadPoolExecutor(max_workers=min(len(uploaded_files), 8)) as executor:
+        return list(executor.map(lambda uploaded_file: prepare_image(uploaded_file, partition), uploaded_files))
+
 def render_chat_interface():
     """Render the main chat interface"""
     
-    # Initialize messages in session state
+    # Initialize messages in session state, restoring the autosaved chat after a refresh
     if 'messages' not in st.session_state:
         st.session_state.messages = []
+        conv_param = st.query_params.get("conversation")
+        if conv_param and conv_param.isdigit():
+            conversation = get_conversation(int(conv_param), st.session_state.partition)
+            if conversation:
+                start_conversation(conversation)
     
     # Load conversation if selected from sidebar
     if 'loaded_conversation' in st.session_state:
-        st.session_state.messages = st.session_state.loaded_conversation['messages']
+        start_conversation(st.session_state.loaded_conversation)
         st.success(f"Loaded: {st.session_state.loaded_conversation['title']}")
         del st.session_state.loaded_conversation
     
@@ -59,13 +138,23 @@ def render_chat_interface():
                     "text/markdown"
                 )
             
-            # Save conversation
-            if st.button("💾 Save Conversation"):
-                title = st.text_input("Conversation title:", value=f"Chat - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-                if title:
-                    conv_type = st.session_state.get('conversation_type', 'general')
-                    conv_id = save_conversation(title, st.session_state.messages, conv_type)
-                    st.success(f"Saved as conversation #{conv_id}")
+            # Conversations are autosaved after every reply; only the title is edited here
+            conv_id = st.session_state.get('conversation_id')
+            if conv_id is not None:
+                st.caption(f"💾 Autosaved as conversation #{conv_id}")
+                title = st.text_input(
+                    "Conversation title:",
+                    value=st.session_state.get('conversation_title', ''),
+                    key=f"conversation_title_{conv_id}"
+                )
+                if st.button("✏️ Rename") and title and title != st.session_state.get('conversation_title'):
+                    try:
+                        rename_conversation(conv_id, title, st.session_state.partition)
+                        st.session_state.conversation_title = title
+                        st.success("Title updated")
+                    except KeyError:
+                        del st.session_state.conversation_id
+                        st.warning("This conversation was deleted; it will be saved again with your next message")
     
     with col1:
         # Display chat messages
@@ -75,6 +164,10 @@ def render_chat_interface():
             for message in st.session_state.messages:
                 if message["role"] == "user":
                     st.markdown(f'<div class="user-message">🧑‍💻 <strong>You:</strong> {message["content"]}</div>', unsafe_allow_html=True)
+                    thumbnails = [get_blob_path(blob_id, True, st.session_state.partition) for blob_id in message.get("images", [])]
+                    thumbnails = [path for path in thumbnails if path]
+                    if thumbnails:
+                        st.image(thumbnails, width=150)
                 else:
                     st.markdown(f'<div class="bot-message">🤖 <strong>AI:</strong> {message["content"]}</div>', unsafe_allow_html=True)
         
@@ -84,11 +177,19 @@ def render_chat_interface():
         # Multi-modal input
         input_type = st.radio("Input Type:", ["Text", "Text + Image"], horizontal=True)
         
-        uploaded_image = None
+        uploaded_images = []
+        analyze_separately = False
         if input_type == "Text + Image":
-            uploaded_image = st.file_uploader("Upload an image", type=['png', 'jpg', 'jpeg'])
-            if uploaded_image:
-                st.image(uploaded_image, caption="Uploaded Image", width=300)
+            uploaded_images = st.file_uploader(
+                "Upload images", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True
+            ) or []
+            if uploaded_images:
+                st.image(uploaded_images, caption=[f.name for f in uploaded_images], width=200)
+            if len(uploaded_images) > 1:
+                analyze_separately = st.checkbox(
+                    "Analyze each image separately",
+                    help="Send one request per image in parallel instead of a single request with all images"
+                )
         
         # Text input with template
         user_input = st.text_area(
@@ -106,13 +207,19 @@ def render_chat_interface():
         
         with col_clear:
             if st.button("🗑️ Clear Chat", use_container_width=True):
-                st.session_state.messages = []
+                reset_conversation()
                 st.rerun()
         
         # Process message
         if send_button and user_input.strip():
-            # Add user message
-            st.session_state.messages.append({"role": "user", "content": user_input})
+            # Add user message, keeping any attached images in the blob store
+            user_message = {"role": "user", "content": user_input}
+            images = []
+            if uploaded_images:
+                prepared = prepare_images(uploaded_images)
+                user_message["images"] = [blob_id for blob_id, _ in prepared]
+                images = [image for _, image in prepared]
+            st.session_state.messages.append(user_message)
             
             # Get AI response
             gemini_client = st.session_state.gemini_client
@@ -120,17 +227,21 @@ def render_chat_interface():
             temperature = st.session_state.get('temperature', 0.7)
             
             with st.spinner("🤔 AI is thinking..."):
-                if uploaded_image:
-                    # Handle image + text
-                    image = Image.open(uploaded_image)
-                    response = gemini_client.analyze_image(image, user_input)
+                if images:
+                    # Handle images + text
+                    response, usage = gemini_client.analyze_images(
+                        images, user_input, batched=not analyze_separately, with_usage=True
+                    )
                 else:
                     # Handle text only
                     context = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages[-5:]])
-                    response = gemini_client.get_smart_response(user_input, context, conversation_type)
+                    response, usage = gemini_client.get_smart_response(
+                        user_input, context, conversation_type, temperature, with_usage=True
+                    )
             
             # Add AI response
-            st.session_state.messages.append({"role": "assistant", "content": response})
+            st.session_state.messages.append(assistant_message(response, usage))
+            autosave_conversation()
             
             st.rerun()
         
@@ -143,21 +254,29 @@ def render_chat_interface():
             
             try:
                 suggestions = st.session_state.gemini_client.suggest_followup(conversation_history)
-                
+            except Exception:
+                suggestions = []  # Skip suggestions if there's an error
+            
+            chosen = None
+            if suggestions:
                 cols = st.columns(len(suggestions))
                 for i, suggestion in enumerate(suggestions):
                     with cols[i]:
                         if st.button(f"💭 {suggestion[:50]}...", key=f"suggestion_{i}"):
-                            st.session_state.messages.append({"role": "user", "content": suggestion})
-                            
-                            # Get AI response for suggestion
-                            with st.spinner("🤔 AI is thinking..."):
-                                context = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages[-5:]])
-                                response = st.session_state.gemini_client.get_smart_response(
-                                    suggestion, context, st.session_state.get('conversation_type', 'general')
-                                )
-                            
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.rerun()
-            except:
-                pass  # Skip suggestions if there's an error
\ No newline at end of file
+                            chosen = suggestion
+            
+            # Answer outside the try above, so storage errors surface instead of being skipped
+            if chosen:
+                st.session_state.messages.append({"role": "user", "content": chosen})
+                
+                # Get AI response for suggestion
+                with st.spinner("🤔 AI is thinking..."):
+                    context = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages[-5:]])
+                    response, usage = st.session_state.gemini_client.get_smart_response(
+                        chosen, context, st.session_state.get('conversation_type', 'general'),
+                        st.session_state.get('temperature', 0.7), with_usage=True
+                    )
+                
+                st.session_state.messages.append(assistant_message(response, usage))
+                autosave_conversation()
+                st.rerun()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import streamlit as st
 from utils.storage import get_conversations, search_conversations, delete_conversation
+from components.chat import reset_conversation
 
 def render_sidebar():
     """Render the sidebar with navigation and conversation history"""
@@ -68,9 +69,9 @@ def render_sidebar():
         search_query = st.text_input("🔍 Search conversations", key="search_conversations")
         
         if search_query:
-            conversations = search_conversations(search_query)
+            conversations = search_conversations(search_query, st.session_state.partition)
         else:
-            conversations = get_conversations()
+            conversations = get_conversations(st.session_state.partition)
         
         # Display conversations
         if conversations:
@@ -90,7 +91,9 @@ def render_sidebar():
                     
                     with col2:
                         if st.button("Delete", key=f"delete_{conv['id']}"):
-                            delete_conversation(conv['id'])
+                            delete_conversation(conv['id'], st.session_state.partition)
+                            if st.session_state.get('conversation_id') == conv['id']:
+                                reset_conversation()
                             st.rerun()
         else:
             st.write("No conversations found")
@@ -113,7 +116,8 @@ def render_sidebar():
         # New conversation button
         if st.button("🆕 New Conversation", use_container_width=True, type="primary"):
             # Clear current conversation
-            for key in ['messages', 'loaded_conversation', 'current_template']:
+            reset_conversation()
+            for key in ['loaded_conversation', 'current_template']:
                 if key in st.session_state:
                     del st.session_state[key]
             st.rerun()
\ No newline at end of file
@@ -1,11 +1,13 @@
 import streamlit as st
 import os
+import secrets
 from dotenv import load_dotenv
 from components.sidebar import render_sidebar
 from components.chat import render_chat_interface
 from pages.analytics import render_analytics
-from utils.storage import init_storage, get_conversations
+from utils.storage import init_storage, get_conversations, partition_key
 from utils.gemini_client import GeminiClient
+from utils.metrics import init_metrics, timed
 
 # Load environment variables
 load_dotenv()
@@ -74,9 +76,41 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def get_session_user():
+    """Identify the user from an auth proxy header or Streamlit login, if any"""
+    # Only trust a header when an auth proxy in front of the app is configured to set it;
+    # otherwise any client could pick another user's partition
+    header = os.getenv('PARTITION_HEADER')
+    if header:
+        user = st.context.headers.get(header)
+        if user:
+            return user
+    
+    st_user = getattr(st, 'user', None)
+    if st_user is not None and getattr(st_user, 'is_logged_in', False):
+        return getattr(st_user, 'email', None)
+    return None
+
+def get_browser_id():
+    """Random id for an anonymous browser, kept in the URL like the open conversation"""
+    browser_id = st.query_params.get("session")
+    if not browser_id:
+        browser_id = secrets.token_hex(16)
+        st.query_params["session"] = browser_id
+    return browser_id
+
 def main():
-    # Initialize storage
-    init_storage()
+    # Each user gets their own storage partition. Without a login, each browser gets one
+    # keyed by the session id in its URL, unless SHARED_HISTORY opts into the shared default
+    if 'partition' not in st.session_state:
+        user = get_session_user()
+        if user is None and os.getenv('SHARED_HISTORY', 'false').lower() != 'true':
+            user = f"browser:{get_browser_id()}"
+        st.session_state.partition = partition_key(user)
+    
+    # Initialize storage and instrumentation
+    init_storage(st.session_state.partition)
+    init_metrics()
     
     # Initialize session state
     if 'current_page' not in st.session_state:
@@ -89,7 +123,8 @@ def main():
             st.session_state.gemini_client = None
     
     # Render sidebar
-    render_sidebar()
+    with timed("render.sidebar"):
+        render_sidebar()
     
     # Main content area
     if st.session_state.gemini_client is None:
@@ -100,9 +135,11 @@ def main():
     # Page routing
     if st.session_state.current_page == 'Chat':
         st.markdown('<h1 class="main-header">AIConverse</h1>', unsafe_allow_html=True)
-        render_chat_interface()
+        with timed("render.chat"):
+            render_chat_interface()
     elif st.session_state.current_page == 'Analytics':
-        render_analytics()
+        with timed("render.analytics"):
+            render_analytics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
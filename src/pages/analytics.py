@@ -2,8 +2,172 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+import os
 from datetime import datetime, timedelta
 from utils.storage import get_conversation_stats, get_conversations
+from utils.gemini_client import GeminiClient
+from utils.metrics import get_ring_buffer, get_prometheus_sink, percentile, summarize_events
+
+def build_timeline_frame(conversations):
+    """Aggregate conversations and messages per day for the activity timeline"""
+    timeline_data = []
+    for conv in conversations:
+        date = datetime.fromisoformat(conv["created_at"]).date()
+        timeline_data.append({
+            "date": date,
+            "conversations": 1,
+            "messages": conv["message_count"]
+        })
+    
+    if not timeline_data:
+        return None
+    
+    timeline_df = pd.DataFrame(timeline_data)
+    return timeline_df.groupby("date").agg({
+        "conversations": "sum",
+        "messages": "sum"
+    }).reset_index()
+
+def build_recent_table(conversations, limit=10):
+    """Rows for the recent conversations table, newest first"""
+    recent_conversations = sorted(conversations, key=lambda x: x["created_at"], reverse=True)[:limit]
+    
+    table_data = []
+    for conv in recent_conversations:
+        created_date = datetime.fromisoformat(conv["created_at"])
+        table_data.append({
+            "Title": conv["title"][:40] + "..." if len(conv["title"]) > 40 else conv["title"],
+            "Type": conv.get("type", "general").title(),
+            "Messages": conv["message_count"],
+            "Created": created_date.strftime("%Y-%m-%d %H:%M"),
+            "Days Ago": (datetime.now() - created_date).days
+        })
+    
+    return table_data
+
+def compute_usage_insights(conversations, stats):
+    """Headline usage insights shown on the dashboard and in the report"""
+    total_days = (datetime.now() - datetime.fromisoformat(conversations[0]["created_at"])).days + 1 if conversations else 1
+    
+    return {
+        "total_days": total_days,
+        "avg_conversations_per_day": round(len(conversations) / total_days, 2),
+        "most_active_type": max(stats["type_distribution"], key=stats["type_distribution"].get) if stats["type_distribution"] else "general",
+        "longest_conversation": max(conversations, key=lambda x: x["message_count"]) if conversations else None
+    }
+
+def split_recent_weeks(conversations):
+    """Split conversations into the last 7 days and the 7 days before that"""
+    now = datetime.now()
+    recent_week, previous_week = [], []
+    for conv in conversations:
+        days = (now - datetime.fromisoformat(conv["created_at"])).days
+        if days <= 7:
+            recent_week.append(conv)
+        elif days <= 14:
+            previous_week.append(conv)
+    return recent_week, previous_week
+
+def estimate_cost(input_tokens, output_tokens):
+    """Estimated spend in USD using per-million-token prices from the environment"""
+    input_price = float(os.getenv("TOKEN_PRICE_INPUT_PER_1M", "0.075"))
+    output_price = float(os.getenv("TOKEN_PRICE_OUTPUT_PER_1M", "0.30"))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+def build_token_type_table(stats, max_output_tokens):
+    """Per-type token totals, averages per response and the configured output cap"""
+    table_data = []
+    for conv_type, totals in sorted(stats["tokens_by_type"].items(), key=lambda x: x[1]["out"], reverse=True):
+        responses = max(totals["responses"], 1)
+        table_data.append({
+            "Type": conv_type.title(),
+            "Responses": totals["responses"],
+            "Input Tokens": totals["in"],
+            "Output Tokens": totals["out"],
+            "Avg Output/Response": round(totals["out"] / responses),
+            "Max Output Tokens": max_output_tokens.get(conv_type, GeminiClient.DEFAULT_MAX_OUTPUT_TOKENS),
+            "Avg Latency (ms)": round(totals["ms"] / responses),
+            "Est. Cost ($)": round(estimate_cost(totals["in"], totals["out"]), 4)
+        })
+    return table_data
+
+def render_token_panel(stats):
+    """Token totals, per-day usage and per-type breakdown"""
+    st.markdown("### 🪙 Token Usage")
+    
+    if not stats["total_input_tokens"] and not stats["total_output_tokens"]:
+        st.write("No token usage recorded yet. New assistant replies will be counted.")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric("Input Tokens", f"{stats['total_input_tokens']:,}")
+    
+    with col2:
+        st.metric("Output Tokens", f"{stats['total_output_tokens']:,}")
+    
+    with col3:
+        st.metric("Estimated Cost", f"${estimate_cost(stats['total_input_tokens'], stats['total_output_tokens']):.4f}")
+    
+    day_df = pd.DataFrame([
+        {"date": day, "Input": totals["in"], "Output": totals["out"]}
+        for day, totals in stats["tokens_by_day"].items()
+    ])
+    fig_tokens = px.bar(
+        day_df,
+        x="date",
+        y=["Input", "Output"],
+        title="Daily Token Usage",
+        labels={"value": "Tokens", "date": "Date", "variable": "Tokens"},
+        color_discrete_sequence=["#667eea", "#764ba2"]
+    )
+    fig_tokens.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+    )
+    st.plotly_chart(fig_tokens, use_container_width=True)
+    
+    client = st.session_state.get("gemini_client")
+    max_output_tokens = client.max_output_tokens if client else GeminiClient.MAX_OUTPUT_TOKENS
+    
+    st.dataframe(pd.DataFrame(build_token_type_table(stats, max_output_tokens)), use_container_width=True, hide_index=True)
+
+def render_performance_panel():
+    """Latency percentiles from the in-memory metrics buffer"""
+    st.markdown("### ⏱️ Performance")
+    
+    ring_buffer = get_ring_buffer()
+    events = ring_buffer.events() if ring_buffer else []
+    if not events:
+        st.write("No timings recorded yet in this server process.")
+        return
+    
+    st.caption(f"Based on the last {len(events)} recorded operations")
+    
+    summary_df = pd.DataFrame(summarize_events(events))
+    st.dataframe(summary_df, use_container_width=True, hide_index=True)
+    
+    model_events = [e for e in events if e["name"].startswith("gemini.")]
+    if model_events:
+        col1, col2, col3, col4 = st.columns(4)
+        
+        ttfts = [e["ttft_ms"] for e in model_events if e.get("ttft_ms") is not None]
+        cache_hits = sum(1 for e in model_events if e.get("cache_hit"))
+        
+        with col1:
+            st.metric("Median Time to First Token", f"{round(percentile(ttfts, 50), 1)} ms")
+        with col2:
+            st.metric("Input Tokens", sum(e.get("input_tokens", 0) for e in model_events))
+        with col3:
+            st.metric("Output Tokens", sum(e.get("output_tokens", 0) for e in model_events))
+        with col4:
+            st.metric("Cache Hit Rate", f"{round(100 * cache_hits / len(model_events))}%")
+    
+    prometheus = get_prometheus_sink()
+    if prometheus:
+        with st.expander("Prometheus metrics"):
+            st.code(prometheus.render(), language="text")
 
 def render_analytics():
     """Render the analytics dashboard"""
@@ -11,11 +175,14 @@ def render_analytics():
     st.markdown('<h1 class="main-header">📊 Analytics Dashboard</h1>', unsafe_allow_html=True)
     
     # Get analytics data
-    stats = get_conversation_stats()
-    conversations = get_conversations()
+    stats = get_conversation_stats(st.session_state.partition)
+    conversations = get_conversations(st.session_state.partition)
     
     if not conversations:
         st.info("No conversations yet. Start chatting to see analytics!")
+        # Timings are recorded from the first page render, before anything is saved
+        st.divider()
+        render_performance_panel()
         return
     
     # Overview metrics
@@ -85,23 +252,9 @@ def render_analytics():
     # Activity timeline
     st.markdown("### 📅 Activity Timeline")
     
-    # Prepare data for timeline
-    timeline_data = []
-    for conv in conversations:
-        date = datetime.fromisoformat(conv["created_at"]).date()
-        timeline_data.append({
-            "date": date,
-            "conversations": 1,
-            "messages": conv["message_count"]
-        })
+    timeline_df = build_timeline_frame(conversations)
     
-    if timeline_data:
-        timeline_df = pd.DataFrame(timeline_data)
-        timeline_df = timeline_df.groupby("date").agg({
-            "conversations": "sum",
-            "messages": "sum"
-        }).reset_index()
-        
+    if timeline_df is not None:
         # Create dual-axis chart
         fig_timeline = go.Figure()
         
@@ -144,23 +297,15 @@ def render_analytics():
     
     st.divider()
     
+    # Token usage
+    render_token_panel(stats)
+    
+    st.divider()
+    
     # Detailed conversation list
     st.markdown("### 📋 Recent Conversations")
     
-    # Sort conversations by date
-    recent_conversations = sorted(conversations, key=lambda x: x["created_at"], reverse=True)[:10]
-    
-    # Create detailed table
-    table_data = []
-    for conv in recent_conversations:
-        created_date = datetime.fromisoformat(conv["created_at"])
-        table_data.append({
-            "Title": conv["title"][:40] + "..." if len(conv["title"]) > 40 else conv["title"],
-            "Type": conv.get("type", "general").title(),
-            "Messages": conv["message_count"],
-            "Created": created_date.strftime("%Y-%m-%d %H:%M"),
-            "Days Ago": (datetime.now() - created_date).days
-        })
+    table_data = build_recent_table(conversations)
     
     if table_data:
         df = pd.DataFrame(table_data)
@@ -174,13 +319,11 @@ def render_analytics():
     with insights_col1:
         st.markdown("#### 🎯 Top Insights")
         
-        # Calculate insights
-        total_days = (datetime.now() - datetime.fromisoformat(conversations[0]["created_at"])).days + 1 if conversations else 1
-        avg_conversations_per_day = round(len(conversations) / total_days, 2)
-        
-        most_active_type = max(stats["type_distribution"], key=stats["type_distribution"].get) if stats["type_distribution"] else "general"
-        
-        longest_conversation = max(conversations, key=lambda x: x["message_count"]) if conversations else None
+        insights = compute_usage_insights(conversations, stats)
+        total_days = insights["total_days"]
+        avg_conversations_per_day = insights["avg_conversations_per_day"]
+        most_active_type = insights["most_active_type"]
+        longest_conversation = insights["longest_conversation"]
         
         st.write(f"📊 **Average conversations per day:** {avg_conversations_per_day}")
         st.write(f"🏆 **Most used conversation type:** {most_active_type.title()}")
@@ -193,8 +336,7 @@ def render_analytics():
         
         if len(conversations) >= 2:
             # Calculate growth
-            recent_week = [c for c in conversations if (datetime.now() - datetime.fromisoformat(c["created_at"])).days <= 7]
-            previous_week = [c for c in conversations if 7 < (datetime.now() - datetime.fromisoformat(c["created_at"])).days <= 14]
+            recent_week, previous_week = split_recent_weeks(conversations)
             
             growth = len(recent_week) - len(previous_week)
             growth_text = "📈 Increasing" if growth > 0 else "📉 Decreasing" if growth < 0 else "➡️ Stable"
@@ -212,6 +354,10 @@ def render_analytics():
         else:
             st.write("Need more conversations to show trends!")
     
+    # Performance panel
+    st.divider()
+    render_performance_panel()
+    
     # Export analytics
     st.divider()
     st.markdown("### 📊 Export Analytics")
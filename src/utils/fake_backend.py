@@ -0,0 +1,55 @@
+import random
+import time
+from types import SimpleNamespace
+
+class FakeResponse:
+    """Minimal stand-in for a Gemini GenerateContentResponse"""
+
+    def __init__(self, text, prompt_tokens, completion_tokens, chunk_delay=0.0):
+        self.text = text
+        self._chunk_delay = chunk_delay
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=completion_tokens,
+            total_token_count=prompt_tokens + completion_tokens
+        )
+
+    def __iter__(self):
+        """Yield the reply a few words at a time, like a streamed response"""
+        words = self.text.split(" ")
+        for i in range(0, len(words), 4):
+            time.sleep(self._chunk_delay)
+            prefix = " " if i else ""
+            yield SimpleNamespace(text=prefix + " ".join(words[i:i + 4]))
+
+class FakeBackend:
+    """Offline model backend for load-testing the pipeline without network access.
+
+    Exposes the same generate_content() call GeminiClient uses on a real
+    GenerativeModel, sleeps for a simulated latency and echoes a canned reply.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        # When streaming, half the latency goes before the first chunk
+        time.sleep(delay / 2 if stream else delay)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise RuntimeError("Simulated backend failure")
+
+        if isinstance(contents, (list, tuple)):
+            prompt = " ".join(c for c in contents if isinstance(c, str))
+        else:
+            prompt = str(contents)
+
+        words = prompt.split()
+        text = f"[fake] {' '.join(words[-20:])}"
+        chunk_count = max(1, (len(text.split(" ")) + 3) // 4)
+        chunk_delay = delay / 2 / chunk_count if stream else 0.0
+        return FakeResponse(text, len(words), len(text.split()), chunk_delay)
@@ -1,39 +1,176 @@
 import google.generativeai as genai
 from PIL import Image
 import streamlit as st
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from threading import Lock, Semaphore
+from utils.metrics import emit
 
 class GeminiClient:
-    def __init__(self, api_key):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        self.vision_model = genai.GenerativeModel('gemini-1.5-flash')
+    # Output token cap per conversation type; tune from the Analytics token panel
+    MAX_OUTPUT_TOKENS = {
+        "general": 1024,
+        "creative": 1024,
+        "technical": 1024,
+        "educational": 1024,
+        "casual": 1024,
+    }
+    DEFAULT_MAX_OUTPUT_TOKENS = 1024
     
-    def generate_text(self, prompt, temperature=0.7):
-        """Generate text response from Gemini"""
+    def __init__(self, api_key, backend=None, cache_size=0, max_concurrency=None, max_output_tokens=None):
+        if backend is None:
+            genai.configure(api_key=api_key)
+            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.vision_model = genai.GenerativeModel('gemini-1.5-flash')
+        else:
+            # Any object with a compatible generate_content() (e.g. FakeBackend)
+            self.model = backend
+            self.vision_model = backend
+        
+        self.max_output_tokens = dict(self.MAX_OUTPUT_TOKENS, **(max_output_tokens or {}))
+        
+        # Optional LRU cache of (prompt, temperature, max tokens) -> response text
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = Lock()
+        
+        # Optional cap on in-flight model calls; time spent waiting is reported as queue wait
+        self._slots = Semaphore(max_concurrency) if max_concurrency else None
+    
+    def _cache_get(self, key):
+        """Return a cached response, or None on a miss"""
+        if not self.cache_size:
+            return None
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+    
+    def _cache_put(self, key, value):
+        """Store a response, evicting the least recently used entry"""
+        if not self.cache_size:
+            return
+        with self._cache_lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _generate(self, model, contents, operation, generation_config=None):
+        """Stream a model call and report queue wait, time to first token, total time and tokens
+
+        Returns (text, usage) where usage is the compact per-message record
+        {"in": prompt tokens, "out": completion tokens, "ms": model latency}.
+        """
+        fields = {"ttft_ms": None, "input_tokens": 0, "output_tokens": 0, "cache_hit": False}
+        enqueued = time.perf_counter()
+        if self._slots:
+            self._slots.acquire()
+        start = time.perf_counter()
+        # Without a concurrency cap nothing waits, so there is no queue wait to report
+        if self._slots:
+            fields["queue_wait_ms"] = round((start - enqueued) * 1000, 3)
+        
+        try:
+            response = model.generate_content(contents, generation_config=generation_config, stream=True)
+            
+            chunks = []
+            for chunk in response:
+                if fields["ttft_ms"] is None:
+                    fields["ttft_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                chunks.append(chunk.text)
+            
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                fields["input_tokens"] = getattr(usage, "prompt_token_count", 0) or 0
+                fields["output_tokens"] = getattr(usage, "candidates_token_count", 0) or 0
+            
+            usage = {
+                "in": fields["input_tokens"],
+                "out": fields["output_tokens"],
+                "ms": round((time.perf_counter() - start) * 1000)
+            }
+            return "".join(chunks), usage
+        except Exception as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            if self._slots:
+                self._slots.release()
+            emit(f"gemini.{operation}", (time.perf_counter() - start) * 1000, **fields)
+    
+    def generate_text(self, prompt, temperature=0.7, max_output_tokens=None, with_usage=False, raise_errors=False):
+        """Generate text response from Gemini
+
+        With with_usage=True returns (text, usage); usage is None on errors
+        and cache hits, since neither made a model call. Errors come back as
+        an "Error: ..." reply unless raise_errors=True.
+        """
+        max_output_tokens = max_output_tokens or self.DEFAULT_MAX_OUTPUT_TOKENS
+        cache_key = (prompt, temperature, max_output_tokens)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            emit("gemini.generate_text", 0.0, cache_hit=True)
+            return (cached, None) if with_usage else cached
+        
         try:
             generation_config = genai.types.GenerationConfig(
                 temperature=temperature,
-                max_output_tokens=1024,
+                max_output_tokens=max_output_tokens,
             )
             
-            response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-            return response.text
+            text, usage = self._generate(self.model, prompt, "generate_text", generation_config)
+            self._cache_put(cache_key, text)
         except Exception as e:
-            return f"Error: {str(e)}"
+            if raise_errors:
+                raise
+            text, usage = f"Error: {str(e)}", None
+        
+        return (text, usage) if with_usage else text
     
-    def analyze_image(self, image, prompt="Describe this image in detail"):
+    def analyze_image(self, image, prompt="Describe this image in detail", with_usage=False):
         """Analyze image with Gemini Vision"""
         try:
-            response = self.vision_model.generate_content([prompt, image])
-            return response.text
+            text, usage = self._generate(self.vision_model, [prompt, image], "analyze_image")
         except Exception as e:
-            return f"Error analyzing image: {str(e)}"
+            text, usage = f"Error analyzing image: {str(e)}", None
+        
+        return (text, usage) if with_usage else text
     
-    def get_smart_response(self, message, context="", conversation_type="general"):
+    def analyze_images(self, images, prompt="Describe these images in detail", batched=True, with_usage=False):
+        """Analyze several images in one turn
+
+        batched=True sends every image in a single multimodal request; otherwise
+        each image is analyzed concurrently and the answers are merged in order.
+        """
+        if len(images) == 1:
+            return self.analyze_image(images[0], prompt, with_usage)
+        
+        if batched:
+            try:
+                text, usage = self._generate(self.vision_model, [prompt, *images], "analyze_images")
+            except Exception as e:
+                text, usage = f"Error analyzing images: {str(e)}", None
+            return (text, usage) if with_usage else text
+        
+        with ThreadPoolExecutor(max_workers=min(len(images), 8)) as executor:
+            results = list(executor.map(lambda image: self.analyze_image(image, prompt, with_usage=True), images))
+        
+        text = "\n\n".join(f"**Image {i}:** {answer}" for i, (answer, _) in enumerate(results, 1))
+        usages = [usage for _, usage in results if usage]
+        usage = {
+            "in": sum(u["in"] for u in usages),
+            "out": sum(u["out"] for u in usages),
+            # Requests ran side by side, so the turn took as long as the slowest one
+            "ms": max(u["ms"] for u in usages)
+        } if usages else None
+        
+        return (text, usage) if with_usage else text
+    
+    def get_smart_response(self, message, context="", conversation_type="general", temperature=0.7, with_usage=False, raise_errors=False):
         """Get contextually aware response"""
         templates = {
             "creative": "You are a creative writing assistant. Be imaginative and artistic in your responses.",
@@ -46,7 +183,9 @@ class GeminiClient:
         
         full_prompt = f"{system_prompt}\n\nContext: {context}\n\nUser: {message}\n\nAssistant:"
         
-        return self.generate_text(full_prompt)
+        max_output_tokens = self.max_output_tokens.get(conversation_type, self.DEFAULT_MAX_OUTPUT_TOKENS)
+        
+        return self.generate_text(full_prompt, temperature, max_output_tokens, with_usage, raise_errors)
     
     def suggest_followup(self, conversation_history):
         """Generate follow-up question suggestions"""
@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Event fields that are counted rather than timed
+TOKEN_FIELDS = ("input_tokens", "output_tokens")
+
+class RingBufferSink:
+    """Keeps the most recent events in memory for the analytics page"""
+
+    def __init__(self, maxlen=5000):
+        self._events = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        with self._lock:
+            self._events.append(event)
+
+    def events(self, prefix=None):
+        with self._lock:
+            events = list(self._events)
+        if prefix:
+            events = [e for e in events if e["name"].startswith(prefix)]
+        return events
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+class JsonlSink:
+    """Appends every event as one JSON line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def emit(self, event):
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+class PrometheusSink:
+    """Aggregates events into Prometheus text exposition format"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        with self._lock:
+            series = self._series.get(event["name"])
+            if series is None:
+                series = {"count": 0, "sum": 0.0, "errors": 0, "recent": deque(maxlen=self.window),
+                          "input_tokens": 0, "output_tokens": 0}
+                self._series[event["name"]] = series
+            series["count"] += 1
+            series["sum"] += event["duration_ms"]
+            series["recent"].append(event["duration_ms"])
+            if event.get("error"):
+                series["errors"] += 1
+            for field in TOKEN_FIELDS:
+                series[field] += event.get(field) or 0
+
+    def render(self):
+        """Current metrics as Prometheus text"""
+        lines = [
+            "# HELP aiconverse_duration_ms Operation duration in milliseconds",
+            "# TYPE aiconverse_duration_ms summary",
+        ]
+        with self._lock:
+            snapshot = {name: dict(s, recent=list(s["recent"])) for name, s in sorted(self._series.items())}
+
+        for name, s in snapshot.items():
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'aiconverse_duration_ms{{name="{name}",quantile="{q}"}} {percentile(s["recent"], q * 100):.3f}')
+            lines.append(f'aiconverse_duration_ms_sum{{name="{name}"}} {s["sum"]:.3f}')
+            lines.append(f'aiconverse_duration_ms_count{{name="{name}"}} {s["count"]}')
+
+        lines.append("# HELP aiconverse_errors_total Operations that raised an error")
+        lines.append("# TYPE aiconverse_errors_total counter")
+        for name, s in snapshot.items():
+            lines.append(f'aiconverse_errors_total{{name="{name}"}} {s["errors"]}')
+
+        lines.append("# HELP aiconverse_tokens_total Model tokens by direction")
+        lines.append("# TYPE aiconverse_tokens_total counter")
+        for name, s in snapshot.items():
+            if s["input_tokens"] or s["output_tokens"]:
+                lines.append(f'aiconverse_tokens_total{{name="{name}",direction="input"}} {s["input_tokens"]}')
+                lines.append(f'aiconverse_tokens_total{{name="{name}",direction="output"}} {s["output_tokens"]}')
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        """Expose render() on http://host:port/metrics from a daemon thread"""
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+_sinks = []
+_ring_buffer = None
+_initialized = False
+_init_lock = threading.Lock()
+
+def init_metrics():
+    """Configure sinks from the environment (once per process)
+
+    METRICS_BUFFER_SIZE     events kept in memory for the analytics page
+    METRICS_JSONL_PATH      also append events to this JSONL file
+    METRICS_PROMETHEUS_PORT also serve Prometheus text on this port
+    """
+    global _ring_buffer, _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        _ring_buffer = RingBufferSink(int(os.getenv("METRICS_BUFFER_SIZE", "5000")))
+        _sinks.append(_ring_buffer)
+
+        jsonl_path = os.getenv("METRICS_JSONL_PATH")
+        if jsonl_path:
+            _sinks.append(JsonlSink(jsonl_path))
+
+        prometheus_port = os.getenv("METRICS_PROMETHEUS_PORT")
+        if prometheus_port:
+            prometheus = PrometheusSink()
+            try:
+                prometheus.serve(int(prometheus_port))
+                _sinks.append(prometheus)
+            except OSError:
+                pass  # Port already bound, e.g. by another app instance
+
+        _initialized = True
+
+def add_sink(sink):
+    """Register an additional sink (anything with an emit(event) method)"""
+    _sinks.append(sink)
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+def get_ring_buffer():
+    """The in-memory sink, or None if metrics were never initialized"""
+    return _ring_buffer
+
+def get_prometheus_sink():
+    for sink in _sinks:
+        if isinstance(sink, PrometheusSink):
+            return sink
+    return None
+
+def emit(name, duration_ms, **fields):
+    """Send one event to every registered sink"""
+    if not _sinks:
+        return
+    event = {"name": name, "ts": time.time(), "duration_ms": round(duration_ms, 3)}
+    event.update(fields)
+    for sink in list(_sinks):
+        try:
+            sink.emit(event)
+        except Exception:
+            pass  # Instrumentation must never break the app
+
+@contextmanager
+def timed(name, **fields):
+    """Time a block (or, as a decorator, a function) and emit an event
+
+    The exception class is recorded as `error` and the exception re-raised.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    except Exception as e:
+        fields["error"] = type(e).__name__
+        raise
+    finally:
+        emit(name, (time.perf_counter() - start) * 1000, **fields)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered), math.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[rank]
+
+def summarize_events(events):
+    """Per-operation count, error count and duration percentiles"""
+    grouped = {}
+    for event in events:
+        grouped.setdefault(event["name"], []).append(event)
+
+    summary = []
+    for name, group in sorted(grouped.items()):
+        durations = [e["duration_ms"] for e in group]
+        summary.append({
+            "Operation": name,
+            "Count": len(group),
+            "Errors": sum(1 for e in group if e.get("error")),
+            "p50 (ms)": round(percentile(durations, 50), 1),
+            "p95 (ms)": round(percentile(durations, 95), 1),
+            "p99 (ms)": round(percentile(durations, 99), 1),
+        })
+    return summary
@@ -1,75 +1,480 @@
+import base64
+import hashlib
+import io
 import json
 import os
+import threading
+import zlib
+from collections import OrderedDict
 from datetime import datetime
 import streamlit as st
 from fpdf import FPDF
+from PIL import Image, ImageOps
+from utils.metrics import timed
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
 # import markdown # type: ignore
 
 DATA_DIR = "data"
 CONVERSATIONS_FILE = os.path.join(DATA_DIR, "conversations.json")
+# Append-only log of changes since the last snapshot in CONVERSATIONS_FILE
+JOURNAL_FILE = os.path.join(DATA_DIR, "conversations.journal.jsonl")
+# Fold the journal into the snapshot once it grows past this many bytes
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+# Content-addressed store for the default partition's attachments; other
+# partitions keep theirs in a blobs/ directory next to their conversations
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")
+THUMBNAIL_SIZE = (256, 256)
+# Message bodies longer than this are stored compressed
+COMPRESS_THRESHOLD = 1024
+# Each user's conversations live in their own partition under this directory;
+# the default partition keeps the original single-file layout above
+PARTITIONS_DIR = os.path.join(DATA_DIR, "users")
+DEFAULT_PARTITION = "default"
+
+# Parsed partitions kept in memory; the least recently used are dropped beyond this
+MAX_CACHED_PARTITIONS = 32
+
+# Partitions hash onto a fixed set of locks guarding their files and cache, so
+# tenants rarely wait on each other and the lock count never grows with users
+PARTITION_LOCK_STRIPES = 64
+_partition_locks = [threading.RLock() for _ in range(PARTITION_LOCK_STRIPES)]
+# Guards the cache registry itself
+_registry_lock = threading.Lock()
+# partition -> parsed conversations, journal read offset and search index (LRU order)
+_partition_caches = OrderedDict()
+
+def _partition_lock(partition):
+    return _partition_locks[hash(partition) % PARTITION_LOCK_STRIPES]
+
+def partition_key(user):
+    """Stable, filesystem-safe partition key for a user identifier"""
+    if not user:
+        return DEFAULT_PARTITION
+    return hashlib.sha256(user.strip().lower().encode("utf-8")).hexdigest()[:16]
 
-def init_storage():
+def _partition_files(partition):
+    """Snapshot and journal paths for a partition"""
+    if partition == DEFAULT_PARTITION:
+        return CONVERSATIONS_FILE, JOURNAL_FILE
+    if not partition.isalnum():
+        raise ValueError(f"Invalid storage partition: {partition!r}")
+    directory = os.path.join(PARTITIONS_DIR, partition)
+    return os.path.join(directory, "conversations.json"), os.path.join(directory, "conversations.journal.jsonl")
+
+def init_storage(partition=DEFAULT_PARTITION):
     """Initialize storage directory and files"""
+    conversations_file, _ = _partition_files(partition)
     os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(CONVERSATIONS_FILE):
-        with open(CONVERSATIONS_FILE, 'w') as f:
+    os.makedirs(_blob_dir(partition), exist_ok=True)
+    os.makedirs(os.path.dirname(conversations_file), exist_ok=True)
+    if not os.path.exists(conversations_file):
+        with open(conversations_file, 'w') as f:
             json.dump([], f)
 
-def save_conversation(title, messages, conversation_type="general"):
-    """Save a conversation to storage"""
-    conversations = get_conversations()
+def _compress(text):
+    data = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd:" + base64.b64encode(zstandard.ZstdCompressor(level=3).compress(data)).decode("ascii")
+    return "zlib:" + base64.b64encode(zlib.compress(data, 6)).decode("ascii")
+
+def _decompress(value):
+    codec, payload = value.split(":", 1)
+    data = base64.b64decode(payload)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Message was stored with zstd; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+def _encode_messages(messages):
+    """Compress large message bodies into a `content_z` field for storage"""
+    encoded = []
+    for msg in messages:
+        if len(msg.get("content", "")) > COMPRESS_THRESHOLD:
+            msg = dict(msg)
+            msg["content_z"] = _compress(msg.pop("content"))
+        encoded.append(msg)
+    return encoded
+
+def _decode_messages(messages):
+    """Inverse of _encode_messages; plain messages pass through untouched"""
+    for msg in messages:
+        if "content_z" in msg:
+            msg["content"] = _decompress(msg.pop("content_z"))
+    return messages
+
+def _encode_conversation(conversation):
+    return dict(conversation, messages=_encode_messages(conversation["messages"]))
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+def _append_journal(entry, partition):
+    """Append one change record; cost depends only on the size of the entry"""
+    _, journal_file = _partition_files(partition)
+    with _partition_lock(partition):
+        # A journal the snapshot already covers (compaction stopped before resetting it)
+        # must not be extended, or its old records would come back with the new one
+        cache = _load_partition(partition)
+        if cache["journal_stale"]:
+            _reset_journal(journal_file, cache)
+        
+        with open(journal_file, 'ab+') as f:
+            # After an interrupted write the file ends mid-line; close off the torn
+            # record so the new one starts on its own line instead of being glued to it
+            f.seek(0, os.SEEK_END)
+            prefix = b""
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    prefix = b"\n"
+            f.write(prefix + (_dumps(entry) + "\n").encode("utf-8"))
+        
+        if os.path.getsize(journal_file) > JOURNAL_COMPACT_BYTES:
+            compact_storage(partition)
+
+def _reset_journal(journal_file, cache):
+    """Replace the journal with an empty one tagged with the snapshot's generation"""
+    header = _dumps({"op": "generation", "generation": cache["generation"]}) + "\n"
+    tmp_file = journal_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        f.write(header)
+    os.replace(tmp_file, journal_file)
     
-    new_conversation = {
-        "id": len(conversations) + 1,
-        "title": title,
-        "messages": messages,
-        "type": conversation_type,
-        "created_at": datetime.now().isoformat(),
-        "message_count": len(messages)
-    }
+    cache["journal_offset"] = len(header.encode("utf-8"))
+    cache["journal_stale"] = False
+
+def _load_snapshot(conversations_file):
+    """Returns (conversations, next_id, generation) from a snapshot file"""
+    try:
+        with open(conversations_file, 'r') as f:
+            snapshot = json.load(f)
+    except:
+        return [], 1, 0
     
-    conversations.append(new_conversation)
+    # Older snapshots are a bare list without an id counter
+    if isinstance(snapshot, list):
+        snapshot = {"conversations": snapshot}
+    conversations = snapshot["conversations"]
+    next_id = snapshot.get("next_id") or max((c["id"] for c in conversations), default=0) + 1
     
-    with open(CONVERSATIONS_FILE, 'w') as f:
-        json.dump(conversations, f, indent=2)
+    for conv in conversations:
+        _decode_messages(conv["messages"])
+    return conversations, next_id, snapshot.get("generation", 0)
+
+def _read_journal(journal_file, offset):
+    """Parse complete journal lines after `offset`; returns (entries, new offset)"""
+    try:
+        with open(journal_file, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
     
-    return new_conversation["id"]
+    # An unterminated last line is either still being written (pick it up next
+    # time) or torn by a crash, in which case the next append terminates it
+    end = data.rfind(b"\n") + 1
+    entries = []
+    for line in data[:end].splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue  # Torn line from an interrupted write
+        
+        if entry["op"] == "create":
+            _decode_messages(entry["conversation"]["messages"])
+        elif entry["op"] == "append":
+            _decode_messages(entry["messages"])
+        entries.append(entry)
+    return entries, offset + end
+
+def _replay(cache, entries):
+    """Apply journal entries to a cached partition
 
-def get_conversations():
-    """Retrieve all conversations"""
+    Conversations are replaced rather than mutated, so lists handed out by
+    get_conversations() never change underneath the caller.
+    """
+    by_id = cache["by_id"]
+    
+    for entry in entries:
+        op = entry["op"]
+        if op == "generation":
+            # Records from an older generation are already part of the snapshot
+            cache["journal_stale"] = entry["generation"] < cache["generation"]
+            continue
+        elif cache["journal_stale"]:
+            continue
+        elif op == "create":
+            conv_id = entry["conversation"]["id"]
+            by_id[conv_id] = entry["conversation"]
+            # Ids are never reused, even after the conversation is deleted
+            cache["next_id"] = max(cache["next_id"], conv_id + 1)
+        elif op == "delete":
+            conv_id = entry["id"]
+            by_id.pop(conv_id, None)
+        elif entry["id"] not in by_id:
+            continue
+        elif op == "append":
+            conv_id = entry["id"]
+            messages = by_id[conv_id]["messages"] + entry["messages"]
+            by_id[conv_id] = dict(
+                by_id[conv_id],
+                messages=messages,
+                message_count=len(messages),
+                tokens=sum_message_tokens(messages)
+            )
+        elif op == "rename":
+            conv_id = entry["id"]
+            by_id[conv_id] = dict(by_id[conv_id], title=entry["title"])
+        else:
+            continue
+        
+        cache["search_text"].pop(conv_id, None)
+
+def _file_signature(path):
     try:
-        with open(CONVERSATIONS_FILE, 'r') as f:
-            return json.load(f)
-    except:
-        return []
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _load_partition(partition):
+    """Cached view of a partition, reading only journal records added since the last call"""
+    conversations_file, journal_file = _partition_files(partition)
+    
+    with _partition_lock(partition):
+        with _registry_lock:
+            cache = _partition_caches.get(partition)
+            if cache is not None:
+                _partition_caches.move_to_end(partition)
+        
+        snapshot_signature = _file_signature(conversations_file)
+        journal_size = os.path.getsize(journal_file) if os.path.exists(journal_file) else 0
+        
+        if (cache is None
+                or cache["files"] != (conversations_file, journal_file)
+                or cache["snapshot_signature"] != snapshot_signature
+                or journal_size < cache["journal_offset"]):
+            conversations, next_id, generation = _load_snapshot(conversations_file)
+            cache = {
+                "files": (conversations_file, journal_file),
+                "snapshot_signature": snapshot_signature,
+                "generation": generation,
+                # Journals without a generation record predate the first compaction
+                "journal_stale": generation > 0,
+                "journal_offset": 0,
+                "by_id": {conv["id"]: conv for conv in conversations},
+                "next_id": next_id,
+                "search_text": {}
+            }
+            with _registry_lock:
+                _partition_caches[partition] = cache
+                while len(_partition_caches) > MAX_CACHED_PARTITIONS:
+                    _partition_caches.popitem(last=False)
+        
+        if journal_size > cache["journal_offset"]:
+            entries, cache["journal_offset"] = _read_journal(journal_file, cache["journal_offset"])
+            _replay(cache, entries)
+        
+        return cache
 
-def search_conversations(query):
+def clear_cache(partition=None):
+    """Drop cached conversations for one partition, or for all of them"""
+    with _registry_lock:
+        if partition is None:
+            _partition_caches.clear()
+        else:
+            _partition_caches.pop(partition, None)
+
+def _write_snapshot(conversations_file, conversations, next_id=None, generation=0):
+    if next_id is None:
+        next_id = max((c["id"] for c in conversations), default=0) + 1
+    
+    tmp_file = conversations_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        f.write(_dumps({
+            "generation": generation,
+            "next_id": next_id,
+            "conversations": [_encode_conversation(conv) for conv in conversations]
+        }))
+    os.replace(tmp_file, conversations_file)
+
+@timed("storage.compact_storage")
+def compact_storage(partition=DEFAULT_PARTITION):
+    """Fold the journal into the snapshot file and start a new, empty journal
+
+    The snapshot gets the next generation number before the journal is reset.
+    If the process dies in between, the old journal's records are from an
+    older generation and are skipped on load instead of being applied twice.
+    """
+    conversations_file, journal_file = _partition_files(partition)
+    # Readers take the same partition lock in _load_partition, so they never
+    # see the new snapshot with the cache still anchored to the old journal
+    with _partition_lock(partition):
+        cache = _load_partition(partition)
+        generation = cache["generation"] + 1
+        _write_snapshot(conversations_file, list(cache["by_id"].values()), cache["next_id"], generation)
+        
+        # Contents are unchanged, so keep the parsed cache and just re-anchor it
+        cache["generation"] = generation
+        cache["snapshot_signature"] = _file_signature(conversations_file)
+        _reset_journal(journal_file, cache)
+
+@timed("storage.save_conversation")
+def save_conversation(title, messages, conversation_type="general", partition=DEFAULT_PARTITION):
+    """Save a conversation to storage"""
+    with _partition_lock(partition):
+        new_conversation = {
+            "id": _load_partition(partition)["next_id"],
+            "title": title,
+            "messages": _stamp_usage(messages),
+            "type": conversation_type,
+            "created_at": datetime.now().isoformat(),
+            "message_count": len(messages),
+            "tokens": sum_message_tokens(messages)
+        }
+        
+        _append_journal({"op": "create", "conversation": _encode_conversation(new_conversation)}, partition)
+    
+    return new_conversation["id"]
+
+def _stamp_usage(messages):
+    """Record the day each new usage record was saved, for per-day token totals"""
+    today = datetime.now().date().isoformat()
+    stamped = []
+    for msg in messages:
+        if msg.get("usage") and "day" not in msg["usage"]:
+            msg = dict(msg, usage=dict(msg["usage"], day=today))
+        stamped.append(msg)
+    return stamped
+
+def _require_conversation(conv_id, partition):
+    if conv_id not in _load_partition(partition)["by_id"]:
+        raise KeyError(f"Conversation {conv_id} does not exist")
+
+@timed("storage.append_messages")
+def append_messages(conv_id, messages, partition=DEFAULT_PARTITION):
+    """Append new messages to an existing conversation
+
+    Raises KeyError if the conversation was deleted, so callers can keep the turns.
+    """
+    if messages:
+        with _partition_lock(partition):
+            _require_conversation(conv_id, partition)
+            _append_journal({"op": "append", "id": conv_id, "messages": _encode_messages(_stamp_usage(messages))}, partition)
+
+@timed("storage.rename_conversation")
+def rename_conversation(conv_id, title, partition=DEFAULT_PARTITION):
+    """Change a conversation's title; raises KeyError if it was deleted"""
+    with _partition_lock(partition):
+        _require_conversation(conv_id, partition)
+        _append_journal({"op": "rename", "id": conv_id, "title": title}, partition)
+
+def sum_message_tokens(messages):
+    """Total prompt/completion tokens and model latency recorded on assistant messages"""
+    totals = {"in": 0, "out": 0, "ms": 0, "responses": 0}
+    for msg in messages:
+        usage = msg.get("usage")
+        if usage:
+            totals["in"] += usage.get("in", 0)
+            totals["out"] += usage.get("out", 0)
+            totals["ms"] += usage.get("ms", 0)
+            totals["responses"] += 1
+    return totals
+
+def conversation_tokens(conversation):
+    """Token totals for a conversation, computed from messages for older records"""
+    return conversation.get("tokens") or sum_message_tokens(conversation["messages"])
+
+def _blob_dir(partition):
+    if partition == DEFAULT_PARTITION:
+        return BLOB_DIR
+    return os.path.join(os.path.dirname(_partition_files(partition)[0]), "blobs")
+
+def _blob_path(blob_id, thumbnail=False, partition=DEFAULT_PARTITION):
+    digest, ext = os.path.splitext(blob_id)
+    name = f"{digest}_thumb.jpg" if thumbnail else f"{digest}{ext}"
+    return os.path.join(_blob_dir(partition), digest[:2], name)
+
+@timed("storage.save_image_blob")
+def save_image_blob(data, filename="image.png", partition=DEFAULT_PARTITION):
+    """Store an image by content hash with a JPEG thumbnail; returns its blob id
+
+    Identical uploads within a partition map to the same id and are written
+    only once; partitions never share blobs, so one user's id is useless to another.
+    """
+    ext = os.path.splitext(filename)[1].lower() or ".png"
+    blob_id = hashlib.sha256(data).hexdigest() + ext
+    path = _blob_path(blob_id, partition=partition)
+    
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # Apply the camera's orientation tag, since the JPEG thumbnail drops EXIF
+        thumbnail = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+        if "A" in thumbnail.getbands() or "transparency" in thumbnail.info:
+            # JPEG has no alpha channel; flatten onto white so transparent areas don't turn black
+            rgba = thumbnail.convert("RGBA")
+            thumbnail = Image.new("RGB", rgba.size, (255, 255, 255))
+            thumbnail.paste(rgba, mask=rgba.getchannel("A"))
+        thumbnail.convert("RGB").save(_blob_path(blob_id, True, partition), "JPEG", quality=80)
+        
+        # Write the original last so its presence means the blob is complete
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    return blob_id
+
+def get_blob_path(blob_id, thumbnail=False, partition=DEFAULT_PARTITION):
+    """Filesystem path of a stored image or its thumbnail, or None if missing"""
+    path = _blob_path(blob_id, thumbnail, partition)
+    return path if os.path.exists(path) else None
+
+@timed("storage.get_conversations")
+def get_conversations(partition=DEFAULT_PARTITION):
+    """Retrieve all conversations (shared with the cache; treat as read-only)"""
+    with _partition_lock(partition):
+        return list(_load_partition(partition)["by_id"].values())
+
+def get_conversation(conv_id, partition=DEFAULT_PARTITION):
+    """Retrieve a single conversation, or None if it does not exist"""
+    return _load_partition(partition)["by_id"].get(conv_id)
+
+@timed("storage.search_conversations")
+def search_conversations(query, partition=DEFAULT_PARTITION):
     """Search conversations by content"""
-    conversations = get_conversations()
+    query = query.lower()
     results = []
     
-    for conv in conversations:
-        # Search in title
-        if query.lower() in conv["title"].lower():
-            results.append(conv)
-            continue
+    with _partition_lock(partition):
+        cache = _load_partition(partition)
+        search_text = cache["search_text"]
         
-        # Search in messages
-        for msg in conv["messages"]:
-            if query.lower() in msg["content"].lower():
+        for conv_id, conv in cache["by_id"].items():
+            # Lowercased title and messages, built once per conversation version
+            text = search_text.get(conv_id)
+            if text is None:
+                text = "\x00".join([conv["title"]] + [msg["content"] for msg in conv["messages"]]).lower()
+                search_text[conv_id] = text
+            
+            if query in text:
                 results.append(conv)
-                break
     
     return results
 
-def delete_conversation(conv_id):
+@timed("storage.delete_conversation")
+def delete_conversation(conv_id, partition=DEFAULT_PARTITION):
     """Delete a conversation"""
-    conversations = get_conversations()
-    conversations = [c for c in conversations if c["id"] != conv_id]
-    
-    with open(CONVERSATIONS_FILE, 'w') as f:
-        json.dump(conversations, f, indent=2)
+    _append_journal({"op": "delete", "id": conv_id}, partition)
 
+@timed("storage.export_conversation_pdf")
 def export_conversation_pdf(conversation):
     """Export conversation as PDF"""
     pdf = FPDF()
@@ -98,6 +503,7 @@ def export_conversation_pdf(conversation):
     # return pdf.output(dest='S').encode('latin-1')
     return bytes(pdf.output(dest='S'))  # ✅ convert to proper binary format
 
+@timed("storage.export_conversation_markdown")
 def export_conversation_markdown(conversation):
     """Export conversation as Markdown"""
     md_content = f"# {conversation['title']}\n\n"
@@ -109,9 +515,10 @@ def export_conversation_markdown(conversation):
     
     return md_content
 
-def get_conversation_stats():
+@timed("storage.get_conversation_stats")
+def get_conversation_stats(partition=DEFAULT_PARTITION):
     """Get analytics data for conversations"""
-    conversations = get_conversations()
+    conversations = get_conversations(partition)
     
     total_conversations = len(conversations)
     total_messages = sum(conv["message_count"] for conv in conversations)
@@ -131,10 +538,38 @@ def get_conversation_stats():
         if conv_time > week_ago:
             recent_count += 1
     
+    # Token usage per day and per conversation type
+    tokens_by_day = {}
+    tokens_by_type = {}
+    total_input_tokens = 0
+    total_output_tokens = 0
+    
+    for conv in conversations:
+        tokens = conversation_tokens(conv)
+        total_input_tokens += tokens["in"]
+        total_output_tokens += tokens["out"]
+        
+        # Bucket by the day each reply was saved; older records fall back to the creation day
+        for msg in conv["messages"]:
+            usage = msg.get("usage")
+            if usage:
+                day = usage.get("day") or conv["created_at"][:10]
+                day_totals = tokens_by_day.setdefault(day, {"in": 0, "out": 0})
+                day_totals["in"] += usage.get("in", 0)
+                day_totals["out"] += usage.get("out", 0)
+        
+        type_totals = tokens_by_type.setdefault(conv.get("type", "general"), {"in": 0, "out": 0, "ms": 0, "responses": 0})
+        for key in type_totals:
+            type_totals[key] += tokens[key]
+    
     return {
         "total_conversations": total_conversations,
         "total_messages": total_messages,
         "type_distribution": type_counts,
         "recent_activity": recent_count,
-        "avg_messages_per_conversation": round(total_messages / max(total_conversations, 1), 1)
+        "avg_messages_per_conversation": round(total_messages / max(total_conversations, 1), 1),
+        "total_input_tokens": total_input_tokens,
+        "total_output_tokens": total_output_tokens,
+        "tokens_by_day": dict(sorted(tokens_by_day.items())),
+        "tokens_by_type": tokens_by_type
     }
\ No newline at end of file
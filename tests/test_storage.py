@@ -0,0 +1,85 @@
+"""Crash-safety tests for the conversation journal.
+
+Run with:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from utils import storage
+
+class JournalCompactionTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._saved = {name: getattr(storage, name) for name in
+                       ("DATA_DIR", "CONVERSATIONS_FILE", "JOURNAL_FILE", "BLOB_DIR", "PARTITIONS_DIR")}
+        tmp_dir = self._tmp.name
+        storage.DATA_DIR = tmp_dir
+        storage.CONVERSATIONS_FILE = os.path.join(tmp_dir, "conversations.json")
+        storage.JOURNAL_FILE = os.path.join(tmp_dir, "conversations.journal.jsonl")
+        storage.BLOB_DIR = os.path.join(tmp_dir, "blobs")
+        storage.PARTITIONS_DIR = os.path.join(tmp_dir, "users")
+        storage.init_storage()
+        storage.clear_cache()
+
+    def tearDown(self):
+        storage.clear_cache()
+        for name, value in self._saved.items():
+            setattr(storage, name, value)
+        self._tmp.cleanup()
+
+    def contents(self, conv_id):
+        """Message bodies as read back from disk by a fresh process"""
+        storage.clear_cache()
+        return [msg["content"] for msg in storage.get_conversation(conv_id)["messages"]]
+
+    def test_crash_between_snapshot_and_journal_reset(self):
+        conv_id = storage.save_conversation("Chat", [{"role": "user", "content": "a"}])
+        storage.compact_storage()
+        storage.append_messages(conv_id, [{"role": "assistant", "content": "b"}])
+
+        # Die after the new snapshot is written but before the journal is reset
+        reset_journal = storage._reset_journal
+        def crash(journal_file, cache):
+            raise SystemExit("killed")
+        storage._reset_journal = crash
+        try:
+            with self.assertRaises(SystemExit):
+                storage.compact_storage()
+        finally:
+            storage._reset_journal = reset_journal
+
+        self.assertEqual(self.contents(conv_id), ["a", "b"])
+
+        # The leftover journal is discarded, not extended, by the next write
+        storage.append_messages(conv_id, [{"role": "user", "content": "c"}])
+        self.assertEqual(self.contents(conv_id), ["a", "b", "c"])
+        storage.compact_storage()
+        self.assertEqual(self.contents(conv_id), ["a", "b", "c"])
+
+    def test_append_after_torn_tail(self):
+        conv_id = storage.save_conversation("Chat", [{"role": "user", "content": "a"}])
+
+        # A write cut off halfway through the line
+        with open(storage.JOURNAL_FILE, 'a') as f:
+            f.write('{"op":"append","id":1,"mess')
+        storage.clear_cache()
+
+        storage.append_messages(conv_id, [{"role": "assistant", "content": "b"}])
+        self.assertEqual(self.contents(conv_id), ["a", "b"])
+
+    def test_legacy_journal_without_generation_is_replayed(self):
+        storage._write_snapshot(storage.CONVERSATIONS_FILE, [])
+        with open(storage.JOURNAL_FILE, 'w') as f:
+            f.write('{"op":"create","conversation":{"id":1,"title":"Old","messages":'
+                    '[{"role":"user","content":"a"}],"type":"general","created_at":"2024-01-01T00:00:00",'
+                    '"message_count":1}}\n')
+
+        self.assertEqual(self.contents(1), ["a"])
+
+if __name__ == "__main__":
+    unittest.main()